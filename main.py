@@ -1,31 +1,101 @@
 import flet as ft
+import asyncio
+import bisect
+import functools
 import json
 import threading
 import os
+import queue
 import shutil
+import sqlite3
 import time
 import re
+import zlib
+from email.utils import parseaddr
+import httplib2
 import ollama
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+try: import ahocorasick  # Optional: faster multi-pattern rule matching
+except ImportError: ahocorasick = None
+try: import orjson  # Optional: faster JSON on the LLM hot path
+except ImportError: orjson = None
+
+def json_loads(s):
+    return orjson.loads(s) if orjson else json.loads(s)
+
+def json_dumps(obj):
+    # Compact str either way (orjson returns bytes)
+    return orjson.dumps(obj).decode() if orjson else json.dumps(obj, separators=(',', ':'))
 
 # --- CONFIG ---
 CONFIG_FILE = 'config.json'
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
+MAX_PROMPT_LABELS = 16  # Bounds prompt (prefill) size no matter how many labels are configured
+LOG_FLUSH_INTERVAL = 1 / 30  # UI log refresh rate (30 Hz)
+MAX_LOG_LINES = 500
+MODEL_PRESETS = {  # Q4_K_M moves ~half the bytes per token of Q8/full precision
+    "Fast": "qwen3:4b-q4_K_M",
+    "Balanced": "qwen3:8b-q4_K_M",
+    "Accurate": "qwen3:8b",
+}
+
+def prepare_config(config):
+    # Derived fields (prefixed "_") live in memory only and are rebuilt whenever the config changes
+    config['_labels_json'] = json_dumps(config['fixed_labels'][:MAX_PROMPT_LABELS])
+    config['_ai_context'] = zlib.crc32(f"{config['model']}|{config['_labels_json']}".encode())
+    config['_blacklist_re'] = _compile_any(config['blacklist_domains'])
+
+    # Full addresses get an O(1) dict hit; every rule (addresses included) still matches as a substring on a miss
+    exact, substr = {}, {}
+    for l, rules in config['label_rules'].items():
+        substr[l] = []
+        for r in rules:
+            r = r.strip().lower()
+            if not r: continue
+            if _is_exact_rule(r): exact.setdefault(r, l)
+            substr[l].append(r)
+    config['_rules_exact'] = exact
+    config['_rules_re'] = {l: _compile_any(r) for l, r in substr.items()}
+    config['_rules_ac'] = _build_automaton(substr)
+    return config
+
+def _is_exact_rule(rule):
+    local, _, domain = rule.partition('@')
+    return bool(local) and '.' in domain and ' ' not in rule
+
+def _build_automaton(label_rules):
+    # All rules in one DFA; value keeps label order so the first matching label still wins
+    if ahocorasick is None: return None
+    A = ahocorasick.Automaton()
+    for idx, (l, rules) in enumerate(label_rules.items()):
+        for r in rules:
+            if r and r.lower() not in A: A.add_word(r.lower(), (idx, l))
+    if len(A) == 0: return None
+    A.make_automaton()
+    return A
+
+def _compile_any(words):
+    # One alternation regex instead of a Python-level substring loop; None when there is nothing to match
+    words = [w.lower() for w in words if w]
+    return re.compile('|'.join(re.escape(w) for w in words)) if words else None
 
 def load_config():
     defaults = {
-        "model": "qwen3:8b",
+        "model": "qwen3:8b-q4_K_M",
         "batch_size": 50,
         "blacklist_domains": ["quora.com", "reddit.com", "temu.com"],
         "fixed_labels": ["Finance", "Work", "Personal", "Receipts", "Family"],
         "label_rules": {"Family": [], "Work": [], "Finance": []}
     }
     if not os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, 'w') as f: json.dump(defaults, f, indent=4)
+        save_config(defaults)
         return defaults
     try:
         with open(CONFIG_FILE, 'r') as f:
@@ -33,11 +103,308 @@ def load_config():
             if "label_rules" not in user: user["label_rules"] = {}
             for k,v in defaults.items():
                 if k not in user: user[k] = v
-            return user
-    except: return defaults
+            return prepare_config(user)
+    except: return prepare_config(defaults)
 
 def save_config(config):
-    with open(CONFIG_FILE, 'w') as f: json.dump(config, f, indent=4)
+    # Write-then-rename so a crash mid-write never leaves a truncated config.json
+    tmp = CONFIG_FILE + '.tmp'
+    with open(tmp, 'w') as f: json.dump({k: v for k, v in config.items() if not k.startswith('_')}, f, separators=(',', ':'))
+    os.replace(tmp, CONFIG_FILE)
+    prepare_config(config)
+
+# --- AI ---
+BANNED_CATEGORIES = {"LABEL", "FOLDER", "CATEGORY", "EMAIL", "UNKNOWN", "NONE"}
+
+def prefilter(email_data, config):
+    # Phase 0 + 1: decisions that never need the LLM. Returns (action, label) or None.
+    email, domain = email_data['email'], email_data['domain']
+
+    # A. Blacklist
+    if config['_blacklist_re'] and config['_blacklist_re'].search(domain):
+        return "DELETE", None
+
+    # B. Rules (exact address first, then substring patterns)
+    email = email.strip().lower()
+    if email in config['_rules_exact']:
+        return "LABEL", config['_rules_exact'][email]
+    if config['_rules_ac'] is not None:
+        hits = [v for _, v in config['_rules_ac'].iter(email)]
+        return ("LABEL", min(hits)[1]) if hits else None
+    for l, rx in config['_rules_re'].items():
+        if rx and rx.search(email):
+            return "LABEL", l
+    return None
+
+MAX_SUBJECT_CHARS = 120
+MAX_SNIPPET_CHARS = 280
+
+def _clip(email_data):
+    # Clip + collapse whitespace: fewer prefill tokens per request
+    return email_data['subject'][:MAX_SUBJECT_CHARS], re.sub(r'\s+', ' ', email_data['snippet'][:MAX_SNIPPET_CHARS])
+
+def build_prompt(email_data, config):
+    subject, snippet = _clip(email_data)
+    return f"""
+    Analyze email.
+    From: {email_data['email']} ({email_data['domain']})
+    Subject: {subject}
+    Content: {snippet}
+    
+    Task: Classify into ONE existing label or 'DELETE'.
+    Available Labels: {config['_labels_json']}
+    
+    Rules:
+    1. Spam/Social/Promos = DELETE
+    2. Receipts/Bills = Finance
+    3. If unsure, use INBOX (Do not invent 'Label' or 'Folder').
+    4. Output JSON: {{ "category": "LabelName" }}
+    """
+
+def build_batch_prompt(items, config):
+    emails = []
+    for i, e in enumerate(items):
+        subject, snippet = _clip(e)
+        emails.append({"id": i, "from": f"{e['email']} ({e['domain']})", "subject": subject, "content": snippet})
+    return f"""
+    Analyze emails.
+    Emails: {json_dumps(emails)}
+    
+    Task: Classify EACH email into ONE existing label or 'DELETE'.
+    Available Labels: {config['_labels_json']}
+    
+    Rules:
+    1. Spam/Social/Promos = DELETE
+    2. Receipts/Bills = Finance
+    3. If unsure, use INBOX (Do not invent 'Label' or 'Folder').
+    4. Output JSON: {{ "decisions": [{{ "id": 0, "category": "LabelName" }}] }} with one entry per email id.
+    """
+
+# Constrained decoding: the model can only emit this object, so no JSON repair is needed
+DECISION_SCHEMA = {'type': 'object', 'properties': {'category': {'type': 'string'}}, 'required': ['category']}
+AI_OPTIONS = {'num_predict': 40, 'temperature': 0}
+KEEP_ALIVE = -1  # Pin weights in memory: the agent polls every few seconds for the whole session
+AI_BATCH_MAX = 16  # Emails per batched prompt
+BATCH_SCHEMA = {'type': 'object', 'properties': {'decisions': {'type': 'array', 'items': {
+    'type': 'object', 'properties': {'id': {'type': 'integer'}, 'category': {'type': 'string'}}, 'required': ['id', 'category']
+}}}, 'required': ['decisions']}
+
+def warm_ollama(config):
+    # Empty prompt only loads the model, so the load happens before the first email, not during it
+    ollama.generate(model=config['model'], prompt='', keep_alive=KEEP_ALIVE)
+
+def parse_decision(content):
+    dec = json_loads(content)
+    return decision_from_category(dec.get('category','INBOX'))
+
+def decision_from_category(c):
+    cu = c.upper()
+    # SANITY CHECK
+    if cu in BANNED_CATEGORIES or cu == "INBOX": return "SKIP", None
+
+    if cu in ('DELETE','SPAM'): return "DELETE", None
+    return "LABEL", c
+
+async def analyze_llm_async(client, email_data, config):
+    res = await client.chat(model=config['model'], messages=[{'role':'user', 'content':build_prompt(email_data, config)}], format=DECISION_SCHEMA, options=AI_OPTIONS, keep_alive=KEEP_ALIVE)
+    return parse_decision(res['message']['content'])
+
+async def analyze_batch_async(client, items, config):
+    # One request classifies many emails; ids the model leaves out come back as None
+    if len(items) == 1: return [await analyze_llm_async(client, items[0], config)]
+    opts = {**AI_OPTIONS, 'num_predict': AI_OPTIONS['num_predict'] * len(items)}
+    res = await client.chat(model=config['model'], messages=[{'role':'user', 'content':build_batch_prompt(items, config)}], format=BATCH_SCHEMA, options=opts, keep_alive=KEEP_ALIVE)
+    out = [None] * len(items)
+    for d in json_loads(res['message']['content']).get('decisions', []):
+        i = d.get('id')
+        if isinstance(i, int) and 0 <= i < len(items) and out[i] is None:
+            out[i] = decision_from_category(d.get('category', 'INBOX'))
+    return out
+
+LENGTH_BINS = [120, 260]  # short / medium / long by clipped len(subject)+len(snippet) (max 120 + 280)
+
+_decision_cache = OrderedDict()  # (domain, subject prefix hash) -> (action, label), LRU, cleared per agent run
+_decision_lock = threading.Lock()
+DECISION_CACHE_MAX = 2048
+
+def _cache_get(key):
+    with _decision_lock:
+        hit = _decision_cache.get(key)
+        if hit: _decision_cache.move_to_end(key)
+        return hit
+
+def _cache_put(key, decision):
+    with _decision_lock:
+        _decision_cache[key] = decision
+        _decision_cache.move_to_end(key)
+        if len(_decision_cache) > DECISION_CACHE_MAX: _decision_cache.popitem(last=False)
+
+DECISION_DB = '.calmmail_cache.db'
+DECISION_TTL = 7 * 24 * 3600  # Seconds before a stored verdict is re-asked
+
+def decision_key(email_data, config):
+    # crc32, not hash(): str hashes are salted per process and the key is persisted.
+    # '_ai_context' ties the verdict to the model + labels it was produced with.
+    return (email_data['domain'], zlib.crc32(email_data['subject'][:24].lower().encode()), config['_ai_context'])
+
+def open_decision_db(path=DECISION_DB):
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE IF NOT EXISTS decisions(domain TEXT, sprefix INTEGER, ctx INTEGER, category TEXT, ts REAL, PRIMARY KEY(domain, sprefix, ctx))")
+    db.execute("DELETE FROM decisions WHERE ts<?", (time.time() - DECISION_TTL,))
+    db.commit()
+    return db
+
+def lookup_decision(db, key):
+    row = db.execute("SELECT category FROM decisions WHERE domain=? AND sprefix=? AND ctx=? AND ts>?", (*key, time.time() - DECISION_TTL)).fetchone()
+    return decision_from_category(row[0]) if row else None
+
+def store_decision(db, key, decision):
+    action, label = decision
+    category = label if action == "LABEL" else ("DELETE" if action == "DELETE" else "INBOX")
+    db.execute("INSERT OR REPLACE INTO decisions VALUES (?, ?, ?, ?, ?)", (*key, category, time.time()))
+
+# In-flight requests beyond the server's parallel slots just queue (and risk timeouts), so match them
+def _env_int(name, default):
+    # Bad values must not stop the GUI from starting
+    try: return max(1, int(os.environ.get(name, default)))
+    except ValueError: return default
+
+AI_MAX_PARALLEL = _env_int('OLLAMA_NUM_PARALLEL', 4)
+
+async def _bounded(sem, coro):
+    async with sem: return await coro
+
+async def classify_pending(client, pending, config, db=None):
+    results = [None] * len(pending)
+    sem = asyncio.Semaphore(AI_MAX_PARALLEL)
+
+    # Reuse earlier verdicts (this run, then on disk); send one request per (domain, subject prefix) group
+    groups = {}
+    for i, e in enumerate(pending):
+        key = decision_key(e, config)
+        hit = _cache_get(key)
+        if not hit and db is not None:
+            hit = lookup_decision(db, key)
+            if hit: _cache_put(key, hit)
+        if hit: results[i] = hit
+        else: groups.setdefault(key, []).append(i)
+
+    # Group similar-length prompts so one long email doesn't stall a whole server batch
+    bins = [[] for _ in range(len(LENGTH_BINS) + 1)]
+    for key, idxs in groups.items():
+        e = pending[idxs[0]]
+        weight = sum(len(x) for x in _clip(e))  # What's actually sent, not the raw message
+        bins[bisect.bisect(LENGTH_BINS, weight)].append(key)
+
+    # Each bin is one wave of batched prompts; within a wave Ollama can run them concurrently (see OLLAMA_NUM_PARALLEL)
+    for keys in bins:
+        if not keys: continue
+        chunks = [keys[j:j + AI_BATCH_MAX] for j in range(0, len(keys), AI_BATCH_MAX)]
+        replies = await asyncio.gather(*[_bounded(sem, analyze_batch_async(client, [pending[groups[k][0]] for k in c], config)) for c in chunks], return_exceptions=True)
+        verdicts = {}
+        for c, r in zip(chunks, replies):
+            if len(c) == 1:
+                # A lone email already went out as its own request; its outcome (or error) is final
+                verdicts[c[0]] = r if isinstance(r, BaseException) else r[0]
+                continue
+            if isinstance(r, BaseException): continue
+            verdicts.update((k, v) for k, v in zip(c, r) if v is not None)
+
+        # Anything the batched reply missed gets its own request
+        retry = [k for k in keys if k not in verdicts]
+        if retry:
+            wave = await asyncio.gather(*[_bounded(sem, analyze_llm_async(client, pending[groups[k][0]], config)) for k in retry], return_exceptions=True)
+            verdicts.update(zip(retry, wave))
+
+        for k in keys:
+            r = verdicts[k]
+            if not isinstance(r, BaseException):
+                _cache_put(k, r)
+                if db is not None: store_decision(db, k, r)
+            for i in groups[k]: results[i] = r
+        if db is not None: db.commit()
+    return results
+
+# --- GMAIL ---
+def _authorized_http(creds):
+    return AuthorizedHttp(creds, http=httplib2.Http(timeout=30))
+
+def build_gmail_service(creds):
+    # One persistent authorized connection reused across execute() calls; bundled discovery doc, no fetch.
+    # cache_discovery=False: the file cache is consulted before the bundled doc and only costs disk I/O here.
+    return build('gmail', 'v1', http=_authorized_http(creds), static_discovery=True, cache_discovery=False)
+
+def list_inbox(service, batch_size, http=None):
+    return service.users().messages().list(userId='me', q='label:INBOX', maxResults=batch_size, fields='messages/id').execute(http=http).get('messages', [])
+
+_ANGLE_ADDR_RE = re.compile(r'<([^<>\s]+@[^<>\s]+)>')
+
+@functools.lru_cache(maxsize=4096)
+def extract_domain_info(sender):
+    # Senders repeat within and across batches, so most calls are cache hits.
+    # The last <addr> wins (display names may be unquoted "Acme, Inc." or contain "<...>");
+    # parseaddr only handles the bracket-less forms ("addr (comment)", bare addresses).
+    found = _ANGLE_ADDR_RE.findall(sender)
+    if found: email = found[-1]
+    else:
+        addr = parseaddr(sender)[1]
+        email = addr if '@' in addr else sender
+    domain = email.rpartition('@')[2].lower().strip() if '@' in email else "unknown"
+    return email, domain
+
+GMAIL_BATCH_LIMIT = 100  # Max sub-requests per batch HTTP call
+METADATA_HEADERS = ['Subject', 'From']  # Only headers the agent reads; Gmail drops the rest server-side
+
+MODIFY_ID_LIMIT = 1000  # batchModify accepts at most 1000 ids per call
+MAX_STALE_RELISTS = 3   # Relists that may still show just-moved mail before the page is taken as-is
+
+def add_move(batch, service, ids, label_id):
+    # Queue INBOX -> label_id moves on an outer batch, split to stay under the batchModify id cap.
+    # Returns {request_id: ids} so the batch callback can tell which ids actually moved.
+    queued = {}
+    for i in range(0, len(ids), MODIFY_ID_LIMIT):
+        chunk = ids[i:i + MODIFY_ID_LIMIT]
+        rid = f"{label_id}:{i}"
+        batch.add(service.users().messages().batchModify(userId='me', body={"ids":chunk,"addLabelIds":[label_id],"removeLabelIds":["INBOX"]}), request_id=rid)
+        queued[rid] = chunk
+    return queued
+
+_label_lock = threading.Lock()
+
+def ensure_label(service, label, label_cache):
+    # Double-checked under the lock so concurrent callers create a label once
+    key = label.lower()
+    lid = label_cache.get(key)
+    if lid: return lid
+    with _label_lock:
+        lid = label_cache.get(key)
+        if lid: return lid
+        try:
+            l = service.users().labels().create(userId='me', body={"name":label,"labelListVisibility":"labelShow","messageListVisibility":"show"}).execute()
+            lid = l['id']; label_cache[key] = lid
+        except: pass
+    return lid
+
+def fetch_metadata(service, msg_ids):
+    # Batched messages.get: one HTTP round-trip per 100 messages instead of one per message
+    prefetched = {}
+
+    def _on_msg(request_id, response, exception):
+        if exception is not None: return
+        # With field masks a message lacking both headers can come back without a payload
+        head = {h['name']: h['value'] for h in response.get('payload', {}).get('headers', [])}
+        prefetched[request_id] = {
+            "subject": head.get('Subject', "No Subject"),
+            "sender": head.get('From', "Unknown"),
+            "snippet": response.get('snippet', '')
+        }
+
+    for i in range(0, len(msg_ids), GMAIL_BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=_on_msg)
+        for mid in msg_ids[i:i + GMAIL_BATCH_LIMIT]:
+            batch.add(service.users().messages().get(userId='me', id=mid, format='metadata', metadataHeaders=METADATA_HEADERS, fields='snippet,payload/headers'), request_id=mid)
+        batch.execute()
+    return prefetched
 
 def main(page: ft.Page):
     page.title = "Calm Mail - Sovereign Agent"
@@ -55,16 +422,25 @@ def main(page: ft.Page):
     chat_column = ft.Column(spacing=10, scroll=ft.ScrollMode.ALWAYS, auto_scroll=True, expand=True)
     status_dot = ft.Container(width=12, height=12, border_radius=6, bgcolor="red")
     status_text = ft.Text("SYSTEM OFFLINE", color="red", weight="bold", size=12)
+    log_q = queue.Queue()
 
     def logger(msg, color="#cccccc"):
         ts = time.strftime('%H:%M:%S')
-        log_column.controls.append(
+        log_q.put_nowait(
             ft.Text(f"[{ts}] {msg}", color=color, font_family="Consolas", size=14, selectable=True)
         )
-        page.update()
+
+    def flush_logs():
+        # One page.update() per frame instead of per log line
+        while True:
+            time.sleep(LOG_FLUSH_INTERVAL)
+            if log_q.empty(): continue
+            while not log_q.empty(): log_column.controls.append(log_q.get_nowait())
+            del log_column.controls[:-MAX_LOG_LINES]
+            page.update()
 
     # --- CHATBOT LOGIC ---
-    def add_chat_message(role, text):
+    def add_chat_message(role, text, flush=True):
         align = ft.MainAxisAlignment.END if role == "user" else ft.MainAxisAlignment.START
         color = "#2a2a2a" if role == "user" else "#004400"
         chat_column.controls.append(
@@ -76,13 +452,13 @@ def main(page: ft.Page):
                 )
             ], alignment=align)
         )
-        page.update()
+        if flush: page.update()
 
     def process_chat_command(e):
         user_text = txt_chat_input.value
         if not user_text: return
         txt_chat_input.value = ""
-        add_chat_message("user", user_text)
+        add_chat_message("user", user_text, flush=False)
         page.update()
         threading.Thread(target=run_chat_ai, args=(user_text,), daemon=True).start()
 
@@ -98,11 +474,11 @@ def main(page: ft.Page):
             Supported Actions: BLACKLIST_ADD (domain), LABEL_CREATE (name), EXPLAIN.
             Output JSON ONLY: {{ "action": "BLACKLIST_ADD", "target": "domain", "response": "msg" }}
             """
-            res = ollama.chat(model=config['model'], messages=[{'role':'user', 'content':prompt}])
+            res = ollama.chat(model=config['model'], messages=[{'role':'user', 'content':prompt}], keep_alive=KEEP_ALIVE)
             content = res['message']['content']
             start = content.find('{')
             end = content.rfind('}') + 1
-            decision = json.loads(content[start:end])
+            decision = json_loads(content[start:end])
             
             action = decision.get('action')
             target = decision.get('target')
@@ -129,6 +505,8 @@ def main(page: ft.Page):
     # --- AGENT LOGIC ---
     def run_agent_logic():
         nonlocal is_running
+        loop = db = ai_client = None
+        with _decision_lock: _decision_cache.clear()
         logger("--- INITIALIZING ---", "#00ff00")
         status_dot.bgcolor = "#00ff00"
         status_text.value = "ACTIVE"
@@ -150,21 +528,54 @@ def main(page: ft.Page):
                     creds = flow.run_local_server(port=0)
                 with open('token.json', 'w') as t: t.write(creds.to_json())
             
-            service = build('gmail', 'v1', credentials=creds)
+            service = build_gmail_service(creds)
             logger("✔ API Connected", "#00ff00")
-            
-            # Label Cache
-            results = service.users().labels().list(userId='me').execute()
+
+            # Model warmup, Label Cache + first inbox page in parallel (one connection each: httplib2 isn't thread-safe)
+            with ThreadPoolExecutor(3) as pool:
+                warm_f = pool.submit(warm_ollama, config)
+                labels_f = pool.submit(service.users().labels().list(userId='me').execute, http=_authorized_http(creds))
+                next_list = pool.submit(list_inbox, service, config['batch_size'], _authorized_http(creds))
+            try:
+                warm_f.result()
+                logger(f"✔ Model Loaded ({config['model']})", "#00ff00")
+            except Exception as e: logger(f"⚠ Model warmup failed: {e}", "orange")
+            results = labels_f.result()
             label_cache = {l['name'].lower(): l['id'] for l in results.get('labels', [])}
+            for l in config['fixed_labels']: ensure_label(service, l, label_cache)
+
+            # One event loop + Ollama client for the lifetime of the agent thread
+            loop = asyncio.new_event_loop()
+            ai_client = ollama.AsyncClient()
+            db = open_decision_db()
+            handled = set()  # ids the last batch successfully trashed/moved
+            queued = {}      # batch request_id -> ids, for on_modify
+            stale_relists = 0
+
+            def on_modify(request_id, response, exception):
+                if exception is not None: logger(f"API Error: {exception}", "red")
+                else: handled.update(queued[request_id])
 
             # CONTINUOUS LOOP
             while is_running:
                 logger(f"Scanning Batch ({config['batch_size']})...", "cyan")
                 try:
-                    msgs = service.users().messages().list(userId='me', q='label:INBOX', maxResults=config['batch_size']).execute().get('messages', [])
+                    msgs = next_list.result() if next_list else list_inbox(service, config['batch_size'])
                 except Exception as e: 
                     logger(f"API Error: {e}", "red")
                     break
+                next_list = None
+
+                # Gmail is eventually consistent: a page listed right after a modify can still show moved mail
+                fresh = [m for m in msgs if m['id'] not in handled]
+                if msgs and not fresh:
+                    stale_relists += 1
+                    # Don't let a lagging list stall the loop: after a few tries treat the page as current
+                    if stale_relists >= MAX_STALE_RELISTS: handled.clear()
+                    time.sleep(1)
+                    continue
+                stale_relists = 0
+                msgs = fresh
                 
                 if not msgs:
                     logger("✨ Inbox Zero. Waiting 10s...", "#00ff00")
@@ -173,62 +584,38 @@ def main(page: ft.Page):
                 
                 trash_ids = []
                 move_map = {}
+
+                try:
+                    prefetched = fetch_metadata(service, [m['id'] for m in msgs])
+                except Exception as e:
+                    logger(f"API Error: {e}", "red")
+                    break
+                if len(prefetched) < len(msgs):
+                    logger(f"⚠ {len(msgs) - len(prefetched)} messages failed to fetch, skipping", "orange")
                 
+                # 1. PREFILTER (Blacklist + Rules)
+                decisions = {}
+                pending = []
                 for msg in msgs:
-                    if not is_running: break
-                    try:
-                        txt = service.users().messages().get(userId='me', id=msg['id'], format='metadata').execute()
-                        head = txt['payload']['headers']
-                        sub = next((h['value'] for h in head if h['name']=='Subject'), "No Subject")
-                        send = next((h['value'] for h in head if h['name']=='From'), "Unknown")
-                        snip = txt.get('snippet', '') # Content Snippet
+                    if msg['id'] not in prefetched: continue
+                    data = prefetched[msg['id']]
+                    data['email'], data['domain'] = extract_domain_info(data['sender'])
+                    early = prefilter(data, config)
+                    if early: decisions[msg['id']] = early
+                    else: pending.append(msg['id'])
 
-                        match = re.search(r'<(.+?)>', send)
-                        email = match.group(1) if match else send
-                        domain = email.split('@')[-1].lower().strip() if '@' in email else "unknown"
+                # 2. AI (Parallel)
+                if pending and is_running:
+                    results = loop.run_until_complete(classify_pending(ai_client, [prefetched[i] for i in pending], config, db))
+                    for mid, res in zip(pending, results):
+                        decisions[mid] = ("SKIP", None) if isinstance(res, BaseException) else res
 
-                        action, label = "SKIP", None
-                        
-                        # A. Blacklist
-                        if any(b in domain for b in config['blacklist_domains']): 
-                            action="DELETE"
-                        
-                        # B. Rules
-                        if action=="SKIP":
-                             for l, r in config['label_rules'].items():
-                                 if any(x.lower() in email.lower() for x in r):
-                                     action, label = "LABEL", l; break
-                        
-                        # C. AI (Improved Prompt)
-                        if action=="SKIP":
-                             prompt_ai = f"""
-                             Analyze email.
-                             From: {email} ({domain})
-                             Subject: {sub}
-                             Content: {snip[:200]}
-                             
-                             Task: Classify into ONE existing label or 'DELETE'.
-                             Available Labels: {json.dumps(config['fixed_labels'])}
-                             
-                             Rules:
-                             1. Spam/Social/Promos = DELETE
-                             2. Receipts/Bills = Finance
-                             3. If unsure, use INBOX (Do not invent 'Label' or 'Folder').
-                             4. Output JSON: {{ "category": "LabelName" }}
-                             """
-                             try:
-                                 res = ollama.chat(model=config['model'], messages=[{'role':'user', 'content':prompt_ai}])
-                                 dec = json.loads(res['message']['content'][res['message']['content'].find('{'):res['message']['content'].rfind('}')+1])
-                                 c = dec.get('category','INBOX')
-                                 
-                                 # SANITY CHECK
-                                 banned = ["LABEL", "FOLDER", "CATEGORY", "EMAIL", "UNKNOWN", "NONE"]
-                                 if c.upper() in banned: c = "INBOX"
-                                 
-                                 if c.upper() in ['DELETE','SPAM']: action="DELETE"
-                                 elif c.upper() != "INBOX": 
-                                     action, label = "LABEL", c
-                             except: pass
+                for msg in msgs:
+                    if not is_running: break
+                    if msg['id'] not in decisions: continue
+                    try:
+                        action, label = decisions[msg['id']]
+                        domain = prefetched[msg['id']]['domain']
                         
                         # Queue Action
                         if action=="DELETE": 
@@ -240,12 +627,7 @@ def main(page: ft.Page):
                                 logger(f"⚠ AI Hallucination blocked ({label})", "orange")
                             else:
                                 logger(f"📂 {domain} -> {label}", "#44aaff")
-                                lid = label_cache.get(label.lower())
-                                if not lid:
-                                    try: 
-                                        l=service.users().labels().create(userId='me', body={"name":label,"labelListVisibility":"labelShow","messageListVisibility":"show"}).execute()
-                                        lid=l['id']; label_cache[label.lower()]=lid
-                                    except: pass
+                                lid = ensure_label(service, label, label_cache)
                                 if lid:
                                     if lid not in move_map: move_map[lid]=[]
                                     move_map[lid].append(msg['id'])
@@ -254,19 +636,32 @@ def main(page: ft.Page):
                 # 3. EXECUTE BATCH
                 if not is_running: break
                 
+                # Trash + every label move share one multipart HTTP round-trip
+                batch = service.new_batch_http_request(callback=on_modify)
+                queued.clear()
+                handled.clear()
                 if trash_ids:
                     logger(f"🔥 Incinerating {len(trash_ids)} items...", "#ff4444")
-                    service.users().messages().batchModify(userId='me', body={"ids":trash_ids,"addLabelIds":["TRASH"],"removeLabelIds":["INBOX"]}).execute()
+                    queued.update(add_move(batch, service, trash_ids, "TRASH"))
 
                 for l, ids in move_map.items():
                     if l == "INBOX": continue
                     logger(f"🚚 Moving {len(ids)} items to {l}...", "#00ff00")
-                    service.users().messages().batchModify(userId='me', body={"ids":ids,"addLabelIds":[l],"removeLabelIds":["INBOX"]}).execute()
-                
-                logger("Batch Done. Syncing...", "#ffffff")
-                time.sleep(3) 
+                    queued.update(add_move(batch, service, ids, l))
+                batch.execute()
+
+                # Only a batch that changed the inbox can surface new mail right away; otherwise pace the rescan
+                if handled: logger("Batch Done.", "#ffffff")
+                else:
+                    logger("Batch Done. Nothing moved, waiting 3s...", "#ffffff")
+                    time.sleep(3)
 
         except Exception as e: logger(f"Error: {e}", "red")
+        finally:
+            # Release the AsyncClient's httpx pool on the loop it was opened on
+            if loop and ai_client: loop.run_until_complete(ai_client._client.aclose())
+            if loop: loop.close()
+            if db: db.close()
         stop_process()
 
     def stop_process():
@@ -329,6 +724,7 @@ def main(page: ft.Page):
     def on_rules_blur(e):
         if dd_labels.value:
              config['label_rules'][dd_labels.value] = [x.strip() for x in txt_rules.value.split('\n') if x.strip()]
+             prepare_config(config)
              
     def on_file_pick(e: ft.FilePickerResultEvent):
         if e.files:
@@ -371,7 +767,19 @@ def main(page: ft.Page):
     cred_exists = os.path.exists("credentials.json")
     cred_status = ft.Text("✅ credentials.json found" if cred_exists else "❌ No credentials.json found", color="green" if cred_exists else "red")
     
-    txt_model = ft.TextField(value=config['model'], label="Model ID")
+    txt_model = ft.TextField(value=config['model'], label="Model ID", expand=True)
+
+    def on_preset_change(e):
+        txt_model.value = MODEL_PRESETS[dd_preset.value]
+        page.update()
+
+    dd_preset = ft.Dropdown(
+        label="Preset",
+        options=[ft.dropdown.Option(k) for k in MODEL_PRESETS],
+        value=next((k for k, v in MODEL_PRESETS.items() if v == config['model']), None),
+        on_change=on_preset_change, width=200,
+        tooltip="Fast/Balanced use Q4_K_M quantization: ~2x faster decoding, slightly lower accuracy.\nAccurate uses the unquantized tag. Run `ollama pull <model>` first."
+    )
     txt_black = ft.TextField(value="\n".join(config['blacklist_domains']), multiline=True, min_lines=4, label="Blacklist", expand=True)
     txt_labels = ft.TextField(value="\n".join(config['fixed_labels']), multiline=True, min_lines=4, label="Labels", expand=True)
     
@@ -390,13 +798,14 @@ def main(page: ft.Page):
             ft.Row([cred_status, ft.ElevatedButton("Import Credentials", icon="upload_file", on_click=lambda _: file_picker.pick_files())], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
             ft.Divider(),
             ft.Text("AI & RULES", weight="bold"),
-            txt_model,
+            ft.Row([dd_preset, txt_model]),
             ft.Row([ft.Column([txt_labels], expand=True), ft.Column([dd_labels, txt_rules], expand=True)], expand=True, spacing=20),
             txt_black,
             ft.ElevatedButton("SAVE SETTINGS", icon="save", on_click=save_settings)
         ], scroll=ft.ScrollMode.AUTO), padding=30
     )
 
+    threading.Thread(target=flush_logs, daemon=True).start()
     page.add(ft.Tabs(tabs=[ft.Tab(text="DASHBOARD", icon="dashboard", content=dashboard), ft.Tab(text="SETTINGS", icon="settings", content=settings)], expand=True))
 
 if __name__ == "__main__":
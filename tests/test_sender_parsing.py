@@ -0,0 +1,33 @@
+import pytest
+
+# main imports flet/ollama/google clients at module level; skip where they aren't installed
+main = pytest.importorskip("main")
+
+
+@pytest.mark.parametrize("sender, expected", [
+    ("Acme, Inc. <billing@acme.com>", ("billing@acme.com", "acme.com")),
+    ("Smith, John <john@corp.com>", ("john@corp.com", "corp.com")),
+    ('"Smith, <J>" <j@x.org>', ("j@x.org", "x.org")),
+    ('"Boss" <Boss@Corp.COM>', ("Boss@Corp.COM", "corp.com")),
+    ("a@B.com", ("a@B.com", "b.com")),
+    ("john@corp.com (John Smith)", ("john@corp.com", "corp.com")),
+    ("Unknown", ("Unknown", "unknown")),
+])
+def test_extract_domain_info(sender, expected):
+    assert main.extract_domain_info(sender) == expected
+
+
+def test_comma_display_names_still_hit_blacklist_and_rules():
+    config = main.prepare_config({
+        "model": "m",
+        "fixed_labels": ["Work"],
+        "blacklist_domains": ["acme.com"],
+        "label_rules": {"Work": ["john@corp.com"]},
+    })
+
+    def decide(sender):
+        email, domain = main.extract_domain_info(sender)
+        return main.prefilter({"email": email, "domain": domain}, config)
+
+    assert decide("Acme, Inc. <billing@acme.com>") == ("DELETE", None)
+    assert decide("Smith, John <john@corp.com>") == ("LABEL", "Work")